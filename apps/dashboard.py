@@ -1,26 +1,40 @@
 # apps/dashboard.py
+import os
 import duckdb
 import pandas as pd
 import streamlit as st
 from pathlib import Path
 
 WAREHOUSE = Path("warehouse/market.duckdb")
+CACHE_TTL = 300  # seconds; shared by the catalog and data caches
+CHART_POINTS = 1000  # history charts are bucketed down to at most this many points
+
+@st.cache_resource(ttl=CACHE_TTL)
+def get_schema_map(_con) -> dict[str, list[str]]:
+    """One catalog scan: {"schema.table": [columns in ordinal order]}."""
+    rows = _con.execute("""
+        SELECT table_schema, table_name, list(column_name ORDER BY ordinal_position)
+        FROM information_schema.columns
+        GROUP BY 1, 2;
+    """).fetchall()
+    return {f"{sch}.{tbl}": cols for sch, tbl, cols in rows}
+
+def qualify(full_name: str) -> str:
+    return full_name if "." in full_name else f"main.{full_name}"
 
 def table_exists(con, full_name: str) -> bool:
-    sch, tbl = full_name.split(".", 1) if "." in full_name else ("main", full_name)
-    return con.execute("""
-        SELECT COUNT(*) FROM information_schema.tables
-        WHERE table_schema = ? AND table_name = ?;
-    """, [sch, tbl]).fetchone()[0] > 0
+    return qualify(full_name) in get_schema_map(con)
 
 def get_columns(con, full_name: str) -> list[str]:
-    sch, tbl = full_name.split(".", 1) if "." in full_name else ("main", full_name)
-    return [r[0] for r in con.execute("""
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_schema = ? AND table_name = ?
-        ORDER BY ordinal_position;
-    """, [sch, tbl]).fetchall()]
+    return list(get_schema_map(con).get(qualify(full_name), []))
+
+def get_column_type(con, full_name: str, column: str) -> str:
+    """DuckDB's spelling of a column's type, e.g. "VARCHAR" or "ENUM('AAPL', 'SPY')"."""
+    sch, tbl = qualify(full_name).split(".", 1)
+    return con.execute("""
+        SELECT data_type FROM duckdb_columns()
+        WHERE schema_name = ? AND table_name = ? AND column_name = ?;
+    """, [sch, tbl, column]).fetchone()[0]
 
 def pick_ticker_col(cols: list[str]) -> str | None:
     for c in ["ticker", "symbol", "Ticker", "SYMBOL"]:
@@ -35,11 +49,14 @@ def pick_close_col(cols: list[str]) -> str | None:
         return '"Close"'  # quoted for case-sensitive name
     return None
 
-@st.cache_data(ttl=300)
-def load_data():
-    con = duckdb.connect(WAREHOUSE.as_posix(), read_only=True)
+def fetch_pandas(con, sql: str, params=None) -> pd.DataFrame:
+    """Run a query and hand the result over via Arrow (cheaper than fetch_df's row conversion)."""
+    cur = con.execute(sql, params or [])
+    to_arrow = getattr(cur, "to_arrow_table", None) or cur.fetch_arrow_table  # renamed in duckdb 1.4
+    return to_arrow().to_pandas(split_blocks=True, self_destruct=True)
 
-    # Pick a source table
+def resolve_source(con) -> tuple[str, str, str, bool]:
+    """Pick the prices table and its (ticker, close) column names; report whether ret_1d is stored."""
     if table_exists(con, "core.fct_prices_daily"):
         src = "core.fct_prices_daily"
     elif table_exists(con, "raw.equity_prices"):
@@ -50,22 +67,32 @@ def load_data():
     cols = get_columns(con, src)
     tcol = pick_ticker_col(cols)
     ccol = pick_close_col(cols)
-    has_ret = "ret_1d" in cols
     if tcol is None or ccol is None:
         raise RuntimeError(f"Missing required columns in {src}. Found: {cols}")
+    return src, tcol, ccol, "ret_1d" in cols
 
-    latest_date = con.execute(f"SELECT MAX(date) FROM {src}").fetchone()[0]
+def connect():
+    # Opened per cache miss and closed right after: a long-lived read-only connection would hold
+    # the warehouse file lock and block the ETL/DQ scripts from writing.
+    return duckdb.connect(WAREHOUSE.as_posix(), read_only=True, config={"threads": str(os.cpu_count() or 1)})
+
+# Loaders below use cache_resource: frames are shared as-is (no pickle/copy per rerun),
+# so callers must treat them as read-only.
+@st.cache_resource(ttl=CACHE_TTL)
+def load_snapshot():
+    con = connect()
+    src, tcol, ccol, has_ret = resolve_source(con)
 
     # Latest prices
     if has_ret:
-        latest_prices = con.execute(f"""
+        latest_prices = fetch_pandas(con, f"""
             SELECT date, {tcol}::VARCHAR AS ticker, {ccol} AS close, ret_1d
             FROM {src}
             WHERE date = (SELECT MAX(date) FROM {src})
             ORDER BY ticker
-        """).fetch_df()
+        """)
     else:
-        latest_prices = con.execute(f"""
+        latest_prices = fetch_pandas(con, f"""
             WITH w AS (
               SELECT
                 date,
@@ -77,47 +104,88 @@ def load_data():
             SELECT * FROM w
             WHERE date = (SELECT MAX(date) FROM w)
             ORDER BY ticker
-        """).fetch_df()
+        """)
 
     # Features (if present)
     feat_exists = table_exists(con, "core.feat_equity_daily")
     if feat_exists:
-        features = con.execute("""
+        features = fetch_pandas(con, """
             SELECT f.date, f.ticker, f.rsi_14, f.momentum_10d, f.vol_21d
             FROM core.feat_equity_daily f
             WHERE f.date = (SELECT MAX(date) FROM core.feat_equity_daily)
             ORDER BY f.ticker
-        """).fetch_df()
+        """)
     else:
         features = pd.DataFrame(columns=["date","ticker","rsi_14","momentum_10d","vol_21d"])
 
-    # History joined with features
-    history = con.execute(f"""
+    tickers = [r[0] for r in con.execute(f"SELECT DISTINCT {tcol}::VARCHAR AS ticker FROM {src} ORDER BY 1").fetchall()]
+    latest_date = latest_prices["date"].max() if not latest_prices.empty else None
+    con.close()
+    return latest_date, latest_prices, features, tickers, feat_exists
+
+@st.cache_resource(ttl=CACHE_TTL)
+def load_history(ticker: str, max_points: int | None = CHART_POINTS) -> pd.DataFrame:
+    """
+    Price history for one ticker, joined with its features when the feature table exists. Read-only.
+    With max_points, dates are split into that many ntile buckets in DuckDB: each bucket keeps its
+    last date/close/features and the mean ret_1d. Series shorter than max_points come back unchanged.
+    """
+    con = connect()
+    src, tcol, ccol, has_ret = resolve_source(con)
+
+    # Cast the parameter, not the column: ENUM tickers then filter on codes inside the scan
+    # (an unknown ticker becomes NULL and matches nothing)
+    tcol_type = get_column_type(con, src, tcol)
+
+    # The ticker filter runs before the window, so a fallback LAG needs no PARTITION BY
+    ret_expr = "ret_1d" if has_ret else f"({ccol} / LAG({ccol}) OVER (ORDER BY date) - 1) AS ret_1d"
+    if table_exists(con, "core.feat_equity_daily"):
+        feat_cols = "feat.rsi_14, feat.momentum_10d, feat.vol_21d"
+        feat_join = "LEFT JOIN core.feat_equity_daily AS feat ON feat.date = p.date AND feat.ticker = p.ticker"
+    else:
+        feat_cols = "NULL::DOUBLE AS rsi_14, NULL::DOUBLE AS momentum_10d, NULL::DOUBLE AS vol_21d"
+        feat_join = ""
+
+    sql = f"""
         WITH p AS (
           SELECT
             date,
-            {tcol}::VARCHAR AS ticker,
+            {tcol} AS ticker,  -- uncast so ENUM tickers join feat on integer codes
             {ccol} AS close,
-            {"ret_1d" if has_ret else f"({ccol} / LAG({ccol}) OVER (PARTITION BY {tcol} ORDER BY date) - 1) AS ret_1d"}
+            {ret_expr}
           FROM {src}
+          WHERE {tcol} = TRY_CAST(? AS {tcol_type})
         )
-        SELECT p.date, p.ticker, p.close, p.ret_1d,
-               feat.rsi_14, feat.momentum_10d, feat.vol_21d
+        SELECT p.date, p.ticker::VARCHAR AS ticker, p.close, p.ret_1d, {feat_cols}
         FROM p
-        LEFT JOIN core.feat_equity_daily AS feat
-          ON feat.date = p.date AND feat.ticker = p.ticker
-        ORDER BY p.ticker, p.date
-    """).fetch_df()
-
-    tickers = sorted(history["ticker"].unique().tolist())
+        {feat_join}
+    """
+    if max_points:
+        history = fetch_pandas(con, f"""
+            WITH h AS ({sql}),
+            b AS (SELECT *, ntile(?) OVER (ORDER BY date) AS bucket FROM h)
+            SELECT
+              MAX(date) AS date,
+              ANY_VALUE(ticker) AS ticker,
+              arg_max_null(close, date) AS close,
+              AVG(ret_1d) AS ret_1d,
+              arg_max_null(rsi_14, date) AS rsi_14,
+              arg_max_null(momentum_10d, date) AS momentum_10d,
+              arg_max_null(vol_21d, date) AS vol_21d
+            FROM b
+            GROUP BY bucket
+            ORDER BY date
+        """, [ticker, max_points])
+    else:
+        history = fetch_pandas(con, sql + "ORDER BY p.date", [ticker])
     con.close()
-    return latest_date, latest_prices, features, history, tickers, feat_exists
+    return history
 
 st.set_page_config(page_title="Equities Snapshot", layout="wide")
 st.title("📈 Equities Snapshot")
 
 try:
-    latest_date, latest_prices, features, history, tickers, feat_exists = load_data()
+    latest_date, latest_prices, features, tickers, feat_exists = load_snapshot()
 except Exception as e:
     st.error(f"Failed to load data: {e}")
     st.stop()
@@ -134,10 +202,11 @@ with right:
 
 st.markdown("---")
 if not tickers:
-    st.info("No tickers found in history.")
+    st.info("No tickers found in prices.")
 else:
     sel = st.selectbox("Pick a ticker for history & features:", tickers)
-    hist = history[history["ticker"] == sel].sort_values("date")
+    raw = st.toggle("Raw daily history (no downsampling)", value=False)
+    hist = load_history(sel, None if raw else CHART_POINTS)
     st.line_chart(hist.set_index("date")["close"])
     st.line_chart(hist.set_index("date")["ret_1d"])
     feat_cols = [c for c in ["rsi_14","momentum_10d","vol_21d"] if c in hist.columns]
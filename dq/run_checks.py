@@ -2,6 +2,7 @@
 import sys
 from pathlib import Path
 import duckdb
+import numpy as np
 import pandas as pd
 
 WAREHOUSE = Path("warehouse/market.duckdb")
@@ -62,6 +63,13 @@ def main():
         print(f"❌ Source table {src} has no 'date' column — cannot run checks.")
         sys.exit(1)
 
+    # Date span scanned once; reused as literals by the gap calendar and the freshness check
+    min_date, max_date = con.execute(f"SELECT MIN(date), MAX(date) FROM {src}").fetchone()
+    if max_date is None:
+        print(f"❌ Source table {src} has no rows — cannot run checks.")
+        sys.exit(1)
+    span_lo, span_hi = f"DATE '{min_date}'", f"DATE '{max_date}'"
+
     hard_fail = False
 
     # 1) Nulls (with breakdown). Allow ret_1d NULL only on the first row per ticker.
@@ -75,15 +83,15 @@ def main():
                     date,
                     {ticker_col} AS ticker,
                     ret_1d,
-                    ROW_NUMBER() OVER (PARTITION BY {ticker_col} ORDER BY date) AS rn
+                    MIN(date) OVER (PARTITION BY {ticker_col}) AS first_d
                   FROM {src}
                 )
                 SELECT
                   SUM(CASE WHEN date   IS NULL THEN 1 ELSE 0 END) AS null_date,
                   SUM(CASE WHEN ticker IS NULL THEN 1 ELSE 0 END) AS null_ticker,
                   CAST(NULL AS BIGINT) AS null_close,
-                  SUM(CASE WHEN ret_1d IS NULL AND rn > 1 THEN 1 ELSE 0 END) AS null_ret_1d_excl_first,
-                  SUM(CASE WHEN ret_1d IS NULL AND rn = 1 THEN 1 ELSE 0 END) AS null_ret_1d_first_rows
+                  SUM(CASE WHEN ret_1d IS NULL AND date IS DISTINCT FROM first_d THEN 1 ELSE 0 END) AS null_ret_1d_excl_first,
+                  SUM(CASE WHEN ret_1d IS NULL AND date = first_d THEN 1 ELSE 0 END) AS null_ret_1d_first_rows
                 FROM ordered;
             """
         else:
@@ -94,15 +102,15 @@ def main():
                     {ticker_col} AS ticker,
                     {close_col} AS close,
                     ret_1d,
-                    ROW_NUMBER() OVER (PARTITION BY {ticker_col} ORDER BY date) AS rn
+                    MIN(date) OVER (PARTITION BY {ticker_col}) AS first_d
                   FROM {src}
                 )
                 SELECT
                   SUM(CASE WHEN date   IS NULL THEN 1 ELSE 0 END) AS null_date,
                   SUM(CASE WHEN ticker IS NULL THEN 1 ELSE 0 END) AS null_ticker,
                   SUM(CASE WHEN close  IS NULL THEN 1 ELSE 0 END) AS null_close,
-                  SUM(CASE WHEN ret_1d IS NULL AND rn > 1 THEN 1 ELSE 0 END) AS null_ret_1d_excl_first,
-                  SUM(CASE WHEN ret_1d IS NULL AND rn = 1 THEN 1 ELSE 0 END) AS null_ret_1d_first_rows
+                  SUM(CASE WHEN ret_1d IS NULL AND date IS DISTINCT FROM first_d THEN 1 ELSE 0 END) AS null_ret_1d_excl_first,
+                  SUM(CASE WHEN ret_1d IS NULL AND date = first_d THEN 1 ELSE 0 END) AS null_ret_1d_first_rows
                 FROM ordered;
             """
         breakdown = con.execute(sql).fetch_df()
@@ -157,13 +165,13 @@ def main():
     if ticker_col:
         sql_gaps = f"""
             WITH cal AS (
-                SELECT d::DATE AS d
-                FROM generate_series(
-                    (SELECT MIN(date) FROM {src}),
-                    (SELECT MAX(date) FROM {src}),
-                    INTERVAL 1 DAY
-                ) t(d)
-                WHERE EXTRACT(ISODOW FROM d) < 6 -- 1..5 = Mon..Fri
+                SELECT d::DATE AS d, (EXTRACT(ISODOW FROM d) < 6)::INT AS is_wd -- 1..5 = Mon..Fri
+                FROM generate_series({span_lo}, {span_hi}, INTERVAL 1 DAY) t(d)
+            ),
+            cal_cum AS (
+                -- running weekday count, so any [a, b] range is two lookups
+                SELECT d, is_wd, SUM(is_wd) OVER (ORDER BY d)::BIGINT AS wd_idx
+                FROM cal
             ),
             per_ticker AS (
                 SELECT {ticker_col} AS ticker, COUNT(DISTINCT date) AS have_days
@@ -178,19 +186,14 @@ def main():
                     MAX(date) AS max_d
                 FROM {src}
                 GROUP BY 1
-            ),
-            expected AS (
-                SELECT s.ticker,
-                    (SELECT COUNT(*) FROM cal WHERE d BETWEEN s.min_d AND s.max_d) AS expected_days
-                FROM span s
             )
-            SELECT e.ticker, 
-                (SELECT min_d FROM span WHERE span.ticker=e.ticker) AS min_d,
-                (SELECT max_d FROM span WHERE span.ticker=e.ticker) AS max_d,
+            SELECT s.ticker, s.min_d, s.max_d,
                 p.have_days,
-                e.expected_days - p.have_days AS missing_weekdays_estimate
-            FROM expected e
+                (cmax.wd_idx - cmin.wd_idx + cmin.is_wd) - p.have_days AS missing_weekdays_estimate
+            FROM span s
             JOIN per_ticker p USING (ticker)
+            JOIN cal_cum cmin ON cmin.d = s.min_d
+            JOIN cal_cum cmax ON cmax.d = s.max_d
             ORDER BY missing_weekdays_estimate DESC
             LIMIT 10;
         """
@@ -198,28 +201,18 @@ def main():
         sql_gaps = f"""
             WITH cal AS (
                 SELECT d::DATE AS d
-                FROM generate_series(
-                    (SELECT MIN(date) FROM {src}),
-                    (SELECT MAX(date) FROM {src}),
-                    INTERVAL 1 DAY
-                ) t(d)
+                FROM generate_series({span_lo}, {span_hi}, INTERVAL 1 DAY) t(d)
                 WHERE EXTRACT(ISODOW FROM d) < 6
             ),
-            span AS (
-                SELECT MIN(date) AS min_d, MAX(date) AS max_d FROM {src}
-            ),
             have AS (
                 SELECT COUNT(DISTINCT date) AS have_days
                 FROM {src}
                 WHERE EXTRACT(ISODOW FROM date) < 6
-            ),
-            expected AS (
-                SELECT (SELECT COUNT(*) FROM cal WHERE d BETWEEN (SELECT min_d FROM span) AND (SELECT max_d FROM span)) AS expected_days
             )
-            SELECT NULL AS ticker, (SELECT min_d FROM span) AS min_d, (SELECT max_d FROM span) AS max_d,
-                (SELECT have_days FROM have) AS have_days,
-                expected.expected_days - (SELECT have_days FROM have) AS missing_weekdays_estimate
-            FROM expected;
+            SELECT NULL AS ticker, {span_lo} AS min_d, {span_hi} AS max_d,
+                have.have_days,
+                (SELECT COUNT(*) FROM cal) - have.have_days AS missing_weekdays_estimate
+            FROM have;
         """
     print(con.execute(sql_gaps).fetch_df().to_string(index=False))
 
@@ -242,24 +235,14 @@ def main():
 
     # 5) Freshness check (within last 3 business days)
     print("\n--- freshness_check ---")
-    max_date = con.execute(f"SELECT MAX(date) FROM {src}").fetchone()[0]
     print(pd.DataFrame([{"max_date": max_date}]).to_string(index=False))
 
-    from datetime import date, timedelta
+    from datetime import date
     today = date.today()
 
-    # count business days difference (Mon-Fri)
-    def business_days_between(a, b):
-        if a > b: a, b = b, a
-        days = 0
-        cur = a
-        while cur < b:
-            if cur.weekday() < 5:  # 0=Mon .. 4=Fri
-                days += 1
-            cur += timedelta(days=1)
-        return days
-
-    bdiff = business_days_between(max_date, today)
+    # count business days difference (Mon-Fri), half-open [earlier, later)
+    lo, hi = sorted((max_date, today))
+    bdiff = int(np.busday_count(np.datetime64(lo, "D"), np.datetime64(hi, "D")))
     print(pd.DataFrame([{"business_days_since_max_date": bdiff}]).to_string(index=False))
 
     # fail if older than 3 business days
@@ -2,23 +2,48 @@ import os, sys
 import duckdb
 
 DB_PATH = os.path.join("warehouse", "market.duckdb")
-GLOB = os.path.join("data", "raw", "equity_prices_*.csv")
+GLOB = os.path.join("data", "raw", "equity_prices_*.parquet")
+TICKER_TYPE = "core.ticker_t"
+
+def ensure_ticker_type(con, tickers_sql: str) -> str:
+    """
+    Keep core.ticker_t an ENUM over every ticker seen so far: its current labels plus the
+    VARCHAR values returned by `tickers_sql`. Labels only grow. Returns the type's spelling
+    (e.g. "ENUM('AAPL', 'SPY')") so callers can compare it with column types.
+    """
+    have = con.execute(
+        "SELECT COUNT(*) FROM duckdb_types() WHERE schema_name = 'core' AND type_name = 'ticker_t'"
+    ).fetchone()[0] > 0
+    old = con.execute(f"SELECT enum_range(NULL::{TICKER_TYPE})").fetchone()[0] if have else []
+    new = [r[0] for r in con.execute(f"SELECT DISTINCT t FROM ({tickers_sql}) AS s(t) WHERE t IS NOT NULL").fetchall()]
+    labels = sorted(set(old) | set(new))
+    if not have or labels != old:
+        # tables keep their own copy of an enum's labels, so replacing the type doesn't touch them
+        if have:
+            con.execute(f"DROP TYPE {TICKER_TYPE}")
+        quoted = ", ".join("'" + l.replace("'", "''") + "'" for l in labels)
+        con.execute(f"CREATE TYPE {TICKER_TYPE} AS ENUM ({quoted})")
+    return con.execute(f"SELECT typeof(NULL::{TICKER_TYPE})").fetchone()[0]
 
 def main():
-    # Check there is at least one CSV to load
+    # Check there is at least one Parquet file to load
     import glob
     files = glob.glob(GLOB)
     if not files:
-        print(f"? No CSVs found at {GLOB}. Run the loader first: python .\\etl\\load_equities_daily.py")
+        print(f"? No Parquet files found at {GLOB}. Run the loader first: python .\\etl\\load_equities_daily.py")
         sys.exit(1)
 
     os.makedirs("warehouse", exist_ok=True)
     con = duckdb.connect(DB_PATH)
+    con.execute(f"PRAGMA threads={os.cpu_count() or 1};")
 
     con.execute("CREATE SCHEMA IF NOT EXISTS raw;")
     con.execute("CREATE SCHEMA IF NOT EXISTS core;")
 
-    # Rebuild raw table from all CSVs (simple and idempotent for now)
+    # Dictionary-encode symbols: joins/partitions on an ENUM hash small integers, not strings
+    ensure_ticker_type(con, f"SELECT DISTINCT UPPER(symbol) FROM read_parquet('{GLOB}', union_by_name=True)")
+
+    # Rebuild raw table from all Parquet files (simple and idempotent for now)
     con.execute(f"""
         CREATE OR REPLACE TABLE raw.equity_prices AS
         SELECT 
@@ -28,12 +53,11 @@ def main():
             CAST(low AS DOUBLE)  AS low,
             CAST(close AS DOUBLE) AS close,
             CAST(volume AS BIGINT) AS volume,
-            UPPER(symbol) AS symbol
-        FROM read_csv_auto('{GLOB}', header=True)
-        ORDER BY symbol, date;
+            CAST(UPPER(symbol) AS {TICKER_TYPE}) AS symbol
+        FROM read_parquet('{GLOB}', union_by_name=True);
     """)
 
-    # Simple core fact table with daily returns
+    # Simple core fact table with daily returns (no ORDER BY: the window sorts per symbol anyway)
     con.execute("""
         CREATE OR REPLACE TABLE core.fct_prices_daily AS
         SELECT
@@ -42,8 +66,7 @@ def main():
             close,
             volume,
             (close / LAG(close) OVER (PARTITION BY symbol ORDER BY date) - 1) AS ret_1d
-        FROM raw.equity_prices
-        ORDER BY symbol, date;
+        FROM raw.equity_prices;
     """)
 
     # Quick sanity prints
@@ -1,71 +1,21 @@
 # etl/build_features_daily.py
 import duckdb
-import pandas as pd
-import numpy as np
+from functools import lru_cache
 from pathlib import Path
 
+from build_duckdb import TICKER_TYPE, ensure_ticker_type  # sibling script; etl/ is on sys.path when run directly
+
 WAREHOUSE = Path("warehouse/market.duckdb")
 FEATURE_TABLE = "core.feat_equity_daily"
 
 # ---- helpers ----
-def rsi_wilder_14(close: pd.Series, period: int = 14) -> pd.Series:
-    delta = close.diff()
-    gain = delta.clip(lower=0.0)
-    loss = -delta.clip(upper=0.0)
-
-    # initial simple means
-    avg_gain = gain.rolling(window=period, min_periods=period).mean()
-    avg_loss = loss.rolling(window=period, min_periods=period).mean()
-
-    # Wilder smoothing continuation
-    avg_gain = avg_gain.combine_first(
-        gain.ewm(alpha=1/period, adjust=False, min_periods=period).mean()
-    )
-    avg_loss = avg_loss.combine_first(
-        loss.ewm(alpha=1/period, adjust=False, min_periods=period).mean()
-    )
-
-    # avoid divide-by-zero
-    denom = avg_loss.replace(0, np.nan)
-    rs = avg_gain / denom
-    rsi = 100 - (100 / (1 + rs))
-    return rsi
-
-def compute_features(df: pd.DataFrame, momentum_lookback: int = 10, vol_window: int = 21) -> pd.DataFrame:
-    # Work only with the needed columns, in case extra columns exist
-    df = df[["date", "ticker", "close", "ret_1d"]].sort_values(["ticker", "date"]).copy()
-
-    def per_ticker(g: pd.DataFrame) -> pd.DataFrame:
-        # g *won't* include the grouping columns when include_groups=False
-        g = g.copy()
-        g["rsi_14"] = rsi_wilder_14(g["close"], 14)
-        g[f"momentum_{momentum_lookback}d"] = (g["close"] / g["close"].shift(momentum_lookback)) - 1.0
-        g["vol_21d"] = g["ret_1d"].rolling(vol_window, min_periods=vol_window).std()
-        return g
-
-    try:
-        # Newer pandas (2.2+): exclude grouping cols during apply, then reattach ticker explicitly
-        out = (
-            df.groupby("ticker", group_keys=False)
-              .apply(lambda g: per_ticker(g).assign(ticker=g.name), include_groups=False)
-              .reset_index(drop=True)
-        )
-    except TypeError:
-        # Fallback for older pandas that doesn't have include_groups=
-        out = (
-            df.groupby("ticker", group_keys=False)
-              .apply(lambda g: per_ticker(g.drop(columns=["ticker"])).assign(ticker=g.name))
-              .reset_index(drop=True)
-        )
-
-    return out[["date", "ticker", "rsi_14", f"momentum_{momentum_lookback}d", "vol_21d"]]
-
-def ensure_schema_and_table(con):
-    con.execute("CREATE SCHEMA IF NOT EXISTS core;")
+def create_feature_table(con, name: str, ticker_type: str):
+    # ticker_type is the literal ENUM('...') spelling: duckdb 1.0 can't bind schema-qualified
+    # user types in column definitions (casts to them work)
     con.execute(f"""
-    CREATE TABLE IF NOT EXISTS {FEATURE_TABLE} (
+    CREATE TABLE IF NOT EXISTS {name} (
         date DATE,
-        ticker VARCHAR,
+        ticker {ticker_type},
         rsi_14 DOUBLE,
         momentum_10d DOUBLE,
         vol_21d DOUBLE,
@@ -73,22 +23,58 @@ def ensure_schema_and_table(con):
     );
     """)
 
+def ensure_schema_and_table(con, tickers_sql: str):
+    """
+    Create the feature table with an ENUM ticker covering `tickers_sql` plus any tickers already stored.
+    When the ENUM gains labels, the table is rebuilt so its ticker column matches the prices tables
+    (identical ENUMs join on integer codes).
+    """
+    con.execute("CREATE SCHEMA IF NOT EXISTS core;")
+    sch, tbl = FEATURE_TABLE.split(".", 1)
+    current = con.execute("""
+        SELECT data_type FROM duckdb_columns()
+        WHERE schema_name = ? AND table_name = ? AND column_name = 'ticker';
+    """, [sch, tbl]).fetchone()
+    if current is not None:
+        tickers_sql = f"{tickers_sql} UNION ALL SELECT ticker::VARCHAR FROM {FEATURE_TABLE}"
+    ticker_type = ensure_ticker_type(con, tickers_sql)
+
+    if current is not None and current[0] != ticker_type:
+        # ticker is part of the primary key, so its type can't be ALTERed in place
+        tmp = f"{FEATURE_TABLE}_rebuild"
+        con.execute("BEGIN TRANSACTION;")
+        con.execute(f"DROP TABLE IF EXISTS {tmp};")
+        create_feature_table(con, tmp, ticker_type)
+        con.execute(f"""
+            INSERT INTO {tmp}
+            SELECT date, CAST(ticker::VARCHAR AS {TICKER_TYPE}), rsi_14, momentum_10d, vol_21d
+            FROM {FEATURE_TABLE};
+        """)
+        con.execute(f"DROP TABLE {FEATURE_TABLE};")
+        con.execute(f"ALTER TABLE {tmp} RENAME TO {tbl};")
+        con.execute("COMMIT;")
+
+    create_feature_table(con, FEATURE_TABLE, ticker_type)
+
+@lru_cache(maxsize=None)
+def get_schema_map(con) -> dict[str, list[str]]:
+    """One catalog scan: {"schema.table": [columns in ordinal order]}."""
+    # cached per connection: DDL issued after the first lookup is not reflected
+    rows = con.execute("""
+        SELECT table_schema, table_name, list(column_name ORDER BY ordinal_position)
+        FROM information_schema.columns
+        GROUP BY 1, 2;
+    """).fetchall()
+    return {f"{sch}.{tbl}": cols for sch, tbl, cols in rows}
+
+def qualify(full_name: str) -> str:
+    return full_name if "." in full_name else f"main.{full_name}"
+
 def table_exists(con, full_name: str) -> bool:
-    sch, tbl = full_name.split(".", 1) if "." in full_name else ("main", full_name)
-    return con.execute("""
-        SELECT COUNT(*) FROM information_schema.tables
-        WHERE table_schema = ? AND table_name = ?;
-    """, [sch, tbl]).fetchone()[0] > 0
+    return qualify(full_name) in get_schema_map(con)
 
 def get_columns(con, full_name: str) -> list[str]:
-    sch, tbl = full_name.split(".", 1) if "." in full_name else ("main", full_name)
-    rows = con.execute("""
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_schema = ? AND table_name = ?
-        ORDER BY ordinal_position;
-    """, [sch, tbl]).fetchall()
-    return [r[0] for r in rows]
+    return list(get_schema_map(con).get(qualify(full_name), []))
 
 def pick_ticker_col(cols: list[str]) -> str | None:
     for c in ["ticker", "symbol", "Ticker", "SYMBOL"]:
@@ -96,11 +82,15 @@ def pick_ticker_col(cols: list[str]) -> str | None:
             return c
     return None
 
-def load_prices_df(con) -> pd.DataFrame:
-    """
-    Load (date, ticker, close, ret_1d) robustly from core.fct_prices_daily or raw.equity_prices.
-    Compute ret_1d if missing.
-    """
+def pick_close_col(cols: list[str]) -> str | None:
+    if "close" in cols:
+        return "close"
+    if "Close" in cols:
+        return '"Close"'  # quoted for case-sensitive identifier
+    return None
+
+def resolve_source(con) -> tuple[str, list[str], str, str | None]:
+    """Pick core.fct_prices_daily or raw.equity_prices; return (source, columns, close column, ticker column)."""
     if table_exists(con, "core.fct_prices_daily"):
         source = "core.fct_prices_daily"
     elif table_exists(con, "raw.equity_prices"):
@@ -112,45 +102,86 @@ def load_prices_df(con) -> pd.DataFrame:
     if "date" not in cols:
         raise RuntimeError(f"'{source}' is missing a 'date' column.")
 
-    # normalize close name if capitalized
-    if "close" not in cols and "Close" in cols:
-        con.execute(f'CREATE OR REPLACE TEMP VIEW _source_norm AS SELECT *, "Close" AS close FROM {source}')
-        source = "_source_norm"
-        cols = get_columns(con, source)
+    close_col = pick_close_col(cols)
+    if close_col is None:
+        raise RuntimeError(f"'{source}' is missing a 'close' column.")
 
-    ticker_col = pick_ticker_col(cols)
+    return source, cols, close_col, pick_ticker_col(cols)
+
+def source_tickers_sql(con) -> str:
+    """SELECT of the distinct tickers (as VARCHAR) the feature build will produce."""
+    source, _, _, ticker_col = resolve_source(con)
     if ticker_col is None:
-        df = con.execute(f"SELECT date, 'UNKNOWN'::VARCHAR AS ticker, close FROM {source} ORDER BY date").fetch_df()
-    else:
-        df = con.execute(f"SELECT date, {ticker_col}::VARCHAR AS ticker, close FROM {source} ORDER BY ticker, date").fetch_df()
+        return "SELECT 'UNKNOWN'"
+    return f"SELECT DISTINCT {ticker_col}::VARCHAR FROM {source}"
+
+def features_sql(con, momentum_lookback: int = 10, vol_window: int = 21, rsi_period: int = 14) -> str:
+    """
+    Build the SELECT producing (date, ticker, rsi_14, momentum_10d, vol_21d) from
+    core.fct_prices_daily or raw.equity_prices. Everything runs inside DuckDB with
+    window functions; ret_1d is derived with LAG if the source doesn't carry it.
+    Tickers come out as core.ticker_t, so ensure_schema_and_table must run first.
+    """
+    source, cols, close_col, ticker_col = resolve_source(con)
+    ticker_expr = f"CAST({ticker_col} AS {TICKER_TYPE})" if ticker_col else f"CAST('UNKNOWN' AS {TICKER_TYPE})"
 
     if "ret_1d" in cols and ticker_col is not None:
-        df_ret = con.execute(f"SELECT date, {ticker_col}::VARCHAR AS ticker, ret_1d FROM {source} ORDER BY ticker, date").fetch_df()
-        df = df.merge(df_ret, on=["date", "ticker"], how="left")
+        ret_expr = "ret_1d"
     else:
-        df["ret_1d"] = df.groupby("ticker")["close"].pct_change()
-
-    df["date"] = pd.to_datetime(df["date"]).dt.date
-    df["ticker"] = df["ticker"].astype(str)
-    return df.sort_values(["ticker", "date"])
+        ret_expr = f"({close_col} / LAG({close_col}) OVER (PARTITION BY {ticker_expr} ORDER BY date) - 1)"
+
+    # RSI uses simple means of gains/losses over the last `rsi_period` deltas;
+    # the COUNT guards mirror pandas' min_periods (no partial windows).
+    return f"""
+        WITH p AS (
+            SELECT
+                CAST(date AS DATE) AS date,
+                {ticker_expr} AS ticker,
+                {close_col} AS close,
+                {ret_expr} AS ret_1d
+            FROM {source}
+        ),
+        d AS (
+            SELECT *, close - LAG(close) OVER w AS delta
+            FROM p
+            WINDOW w AS (PARTITION BY ticker ORDER BY date)
+        ),
+        s AS (
+            SELECT
+                date,
+                ticker,
+                AVG(GREATEST(delta, 0.0)) OVER w_rsi AS avg_gain,
+                AVG(GREATEST(-delta, 0.0)) OVER w_rsi AS avg_loss,
+                COUNT(delta) OVER w_rsi AS n_rsi,
+                close / LAG(close, {momentum_lookback}) OVER w - 1 AS momentum,
+                STDDEV_SAMP(ret_1d) OVER w_vol AS vol,
+                COUNT(ret_1d) OVER w_vol AS n_vol
+            FROM d
+            WINDOW
+                w AS (PARTITION BY ticker ORDER BY date),
+                w_rsi AS (w ROWS BETWEEN {rsi_period - 1} PRECEDING AND CURRENT ROW),
+                w_vol AS (w ROWS BETWEEN {vol_window - 1} PRECEDING AND CURRENT ROW)
+        )
+        SELECT
+            date,
+            ticker,
+            CASE WHEN n_rsi = {rsi_period}
+                 THEN 100 - 100 / (1 + avg_gain / NULLIF(avg_loss, 0)) END AS rsi_{rsi_period},
+            momentum AS momentum_{momentum_lookback}d,
+            CASE WHEN n_vol = {vol_window} THEN vol END AS vol_{vol_window}d
+        FROM s
+    """
 
 def main():
     con = duckdb.connect(WAREHOUSE.as_posix())
 
-    # 1) Load normalized price data
-    prices = load_prices_df(con)
-
-    # 2) Compute features in pandas
-    feat = compute_features(prices, momentum_lookback=10, vol_window=21)
-
-    # 3) Ensure destination table
-    ensure_schema_and_table(con)
+    # 1) Ensure ticker ENUM and destination table
+    ensure_schema_and_table(con, source_tickers_sql(con))
 
-    # 4) Register DataFrame and stage → MERGE (this fixes the DuckDB error)
-    con.register("feat_df", feat)
-    con.execute("CREATE OR REPLACE TEMP TABLE _stg_feat AS SELECT * FROM feat_df")
-    con.unregister("feat_df")
+    # 2) Compute features in DuckDB and stage them
+    con.execute(f"CREATE OR REPLACE TEMP TABLE _stg_feat AS {features_sql(con, momentum_lookback=10, vol_window=21)}")
 
+    # 3) Upsert staged features
     con.execute(f"""
     MERGE INTO {FEATURE_TABLE} AS t
     USING _stg_feat AS s
@@ -163,7 +194,7 @@ def main():
     VALUES (s.date, s.ticker, s.rsi_14, s.momentum_10d, s.vol_21d);
     """)
 
-    # 5) quick peek
+    # 4) quick peek
     sample = con.execute(f"""
         SELECT * FROM {FEATURE_TABLE}
         ORDER BY date DESC, ticker
@@ -4,7 +4,7 @@ import pandas as pd
 import yfinance as yf
 
 # You can override tickers via environment variable: TICKERS="SPY,AAPL,MSFT"
-TICKERS = os.getenv("TICKERS", "SPY,AAPL,MSFT").split(",")
+TICKERS = [t.strip() for t in os.getenv("TICKERS", "SPY,AAPL,MSFT").split(",") if t.strip()]
 
 def flatten_cols(cols):
     """Flatten possible MultiIndex columns into simple strings."""
@@ -17,14 +17,15 @@ def flatten_cols(cols):
             flat.append(str(c))
     return flat
 
-def pick_col(df, base, ticker):
+def build_colmap(df):
+    """Map lowercased column names to the originals (built once per frame, reused by pick_col)."""
+    return {c.lower(): c for c in df.columns}
+
+def pick_col(colmap, base, ticker):
     """
     Find a column for a given base name (e.g., 'open') across different yfinance variants,
     such as 'open', 'Open', 'open_SPY', 'SPY_Open', etc.
     """
-    cols = [c.lower() for c in df.columns]
-    colmap = dict(zip(cols, df.columns))  # lower->original
-
     base = base.lower().replace(" ", "_")
     t = ticker.lower()
 
@@ -41,14 +42,15 @@ def pick_col(df, base, ticker):
 
     # direct matches first
     for cand in candidates:
-        cand_l = cand.replace(" ", "_")
-        if cand_l in colmap:
-            return colmap[cand_l]
+        hit = colmap.get(cand.replace(" ", "_"))
+        if hit is not None:
+            return hit
 
     # fallback: any column that starts with base_
-    for c in cols:
-        if c.startswith(base + "_"):
-            return colmap[c]
+    base_prefix = base + "_"
+    for c_l, c in colmap.items():
+        if c_l.startswith(base_prefix):
+            return c
 
     return None
 
@@ -56,41 +58,31 @@ end = date.today()
 start = end - timedelta(days=120)
 
 os.makedirs("data/raw", exist_ok=True)
-out_path = os.path.join("data", "raw", f"equity_prices_{end.strftime('%Y%m%d')}.csv")
-
-rows = []
-for t in TICKERS:
-    t = t.strip()
-    df = yf.download(
-        t,
-        start=start,
-        end=end + timedelta(days=1),
-        interval="1d",
-        auto_adjust=True,     # adjusted prices (no 'Adj Close' column)
-        progress=False,
-        group_by="column",    # helps avoid nested columns, but we'll normalize anyway
-    )
+out_path = os.path.join("data", "raw", f"equity_prices_{end.strftime('%Y%m%d')}.parquet")
 
+def normalize(df, t):
+    """Normalize one ticker's yfinance frame to (date, OHLCV, symbol); returns None (after printing why) if unusable."""
     if not isinstance(df, pd.DataFrame) or df.empty:
         print(f"⚠️ No data for {t}")
-        continue
+        return None
 
     df = df.reset_index()
     df.columns = flatten_cols(df.columns)
     df.columns = [c.lower().replace(" ", "_") for c in df.columns]
+    colmap = build_colmap(df)
 
     # Find the right columns regardless of suffix/prefix
-    c_open   = pick_col(df, "open", t)
-    c_high   = pick_col(df, "high", t)
-    c_low    = pick_col(df, "low", t)
-    c_close  = pick_col(df, "close", t)
-    c_volume = pick_col(df, "volume", t)
+    c_open   = pick_col(colmap, "open", t)
+    c_high   = pick_col(colmap, "high", t)
+    c_low    = pick_col(colmap, "low", t)
+    c_close  = pick_col(colmap, "close", t)
+    c_volume = pick_col(colmap, "volume", t)
 
     needed = {"open": c_open, "high": c_high, "low": c_low, "close": c_close, "volume": c_volume}
     missing = [k for k, v in needed.items() if v is None]
     if missing or "date" not in df.columns:
         print(f"⚠️ Missing columns for {t}: {missing or []}. Got cols={list(df.columns)}")
-        continue
+        return None
 
     df = df.rename(columns={
         c_open: "open",
@@ -101,13 +93,53 @@ for t in TICKERS:
     })
 
     df["symbol"] = t.upper()
-    df = df[["date", "open", "high", "low", "close", "volume", "symbol"]]
-    rows.append(df)
+    return df[["date", "open", "high", "low", "close", "volume", "symbol"]]
+
+def download_batch(tickers):
+    """One batched request for `tickers`; yfinance threads it internally."""
+    return yf.download(
+        tickers,
+        start=start,
+        end=end + timedelta(days=1),
+        interval="1d",
+        auto_adjust=True,     # adjusted prices (no 'Adj Close' column)
+        progress=False,
+        group_by="ticker",    # columns become (ticker, field)
+        threads=True,
+    )
+
+def split_batch(df_all, tickers):
+    """Slice each ticker out of a batch; returns (normalized frames, tickers with no rows)."""
+    rows, missing = [], []
+    if not isinstance(df_all, pd.DataFrame):
+        return rows, list(tickers)
+    for t in tickers:
+        if isinstance(df_all.columns, pd.MultiIndex):
+            sub = df_all[t] if t in df_all.columns.get_level_values(0) else None
+        else:
+            # some yfinance versions return flat columns when the batch holds a single ticker
+            sub = df_all if len(tickers) == 1 else None
+        if sub is not None:
+            sub = sub.dropna(how="all")  # rows for other tickers' trading days come back all-NaN
+        if sub is None or sub.empty:
+            missing.append(t)
+            continue
+        rows.append(normalize(sub, t))
+    return rows, missing
+
+rows, retry = split_batch(download_batch(TICKERS), TICKERS)
+if retry:
+    # one more batched attempt for whatever the first call missed
+    more, missing = split_batch(download_batch(retry), retry)
+    rows.extend(more)
+    for t in missing:
+        print(f"⚠️ No data for {t}")
+rows = [r for r in rows if r is not None]
 
 if rows:
     out = pd.concat(rows, ignore_index=True)
     out.sort_values(["symbol", "date"], inplace=True)
-    out.to_csv(out_path, index=False)
+    out.to_parquet(out_path, compression="zstd", index=False)
     print(f"✅ Saved {len(out)} rows → {out_path}")
 else:
     print("❌ No data fetched. Check internet connection or tickers.")